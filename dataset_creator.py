@@ -1,4 +1,5 @@
-from tdb import TelethonHandler, Utils
+from tdb import TelethonHandler, Utils, Profiler
+import argparse
 
 # This script creates a dataset of the messages available in the different channel_names.
 # By providing a folder, this script will create a subfolder for each channel and for each chat.
@@ -6,6 +7,11 @@ from tdb import TelethonHandler, Utils
 # The channels info is also stored.
 
 if __name__ == "__main__":
+    parser= argparse.ArgumentParser(description="Create a dataset of the messages in telegram channels.")
+    parser.add_argument("--profile", type=int, default=None, metavar="N_BATCHES", help="Profile the first N_BATCHES batches and write a report.")
+    parser.add_argument("--profile-output", default=None, help="Path of the profile report. Defaults to profile_report.txt in the output folder.")
+    args= parser.parse_args()
+
     # Define the names of the telegram channels to retrieve message from. (Can be names or ID-s)
     channel_names= ["foo", "bar"]
 
@@ -21,37 +27,51 @@ if __name__ == "__main__":
     TG = TelethonHandler(telegram_env_path)
     TG.connect_client()
 
-    # First step: Get information of all channels.
-    output_channel_info= {}
-    for channel_name in channel_names:
-        output_channel_info[channel_name]= {}
-        chats_ids= TG.get_channel_chats(channel_name)
-        for chat_id in chats_ids:
-            output_channel_info[channel_name][chat_id] = TG.get_chat_info(chat_id)
-
-    # Dump channels info to file.
-    Utils.save_dict(output_channel_info, output_channel_info_path)
-
-
-    for channel_name in channel_names:
-        print(f"Channel {channel_name} gathering.")
-        Utils.create_folder_if_not_exists(f"{output_chats_path}/{channel_name}") # Create folder if not exists
-        chats_ids= TG.get_channel_chats(channel_name)
-        for chat_id in chats_ids:
-            print(f"\tChat {chat_id} gathering.")
-            Utils.create_folder_if_not_exists(f"{output_chats_path}/{channel_name}/{chat_id}") # Create folder if not exists
-            _offset=0 # First message to retrieve
-            n_batch= 0 # Batch counter
-            while _offset is not None:
-                n_batch += 1 # Batch counter incrementation
-                messages, _offset= TG.get_n_messages(chat_id, n_messages=BATCH_SIZE, offset_id=_offset) # Get messagges per batch
-                msgs= {}
-                if messages and _offset: # If messages retrieved
-                    for message in messages:
-                        msgs= {**msgs, **Utils.format_message(message)} # Convert to dict the messages and aggregate in a single dict
-                    Utils.save_dict(msgs, f"{output_chats_path}/{channel_name}/{chat_id}/batch_{n_batch}.json")
-                    print(f"\t\tBatch {n_batch} dump.")
-            print("\t\tChat dump finished.")
-        print("\t\tChannel dump finished.")
+    # Time split in network, formatting and disk I/O. Disabled if --profile is not set. Started after the login.
+    profiler= Profiler(args.profile, args.profile_output or f"{output_chats_path}/profile_report.txt")
+
+    try:
+        # First step: Get information of all channels.
+        output_channel_info= {}
+        for channel_name in channel_names:
+            output_channel_info[channel_name]= {}
+            with profiler.section("network"):
+                chats_ids= TG.get_channel_chats(channel_name)
+            for chat_id in chats_ids:
+                with profiler.section("network"):
+                    output_channel_info[channel_name][chat_id] = TG.get_chat_info(chat_id)
+
+        # Dump channels info to file.
+        with profiler.section("disk_io"):
+            Utils.save_dict(output_channel_info, output_channel_info_path)
+
+
+        for channel_name in channel_names:
+            print(f"Channel {channel_name} gathering.")
+            Utils.create_folder_if_not_exists(f"{output_chats_path}/{channel_name}") # Create folder if not exists
+            with profiler.section("network"):
+                chats_ids= TG.get_channel_chats(channel_name)
+            for chat_id in chats_ids:
+                print(f"\tChat {chat_id} gathering.")
+                Utils.create_folder_if_not_exists(f"{output_chats_path}/{channel_name}/{chat_id}") # Create folder if not exists
+                _offset=0 # First message to retrieve
+                n_batch= 0 # Batch counter
+                while _offset is not None:
+                    n_batch += 1 # Batch counter incrementation
+                    with profiler.section("network"):
+                        messages, _offset= TG.get_n_messages(chat_id, n_messages=BATCH_SIZE, offset_id=_offset) # Get messagges per batch
+                    msgs= {}
+                    if messages and _offset: # If messages retrieved
+                        with profiler.section("formatting"):
+                            for message in messages:
+                                msgs= {**msgs, **Utils.format_message(message)} # Convert to dict the messages and aggregate in a single dict
+                        with profiler.section("disk_io"):
+                            Utils.save_dict(msgs, f"{output_chats_path}/{channel_name}/{chat_id}/batch_{n_batch}.json")
+                        print(f"\t\tBatch {n_batch} dump.")
+                        profiler.step()
+                print("\t\tChat dump finished.")
+            print("\t\tChannel dump finished.")
+    finally:
+        profiler.finish() # Write the report if less batches than requested were profiled or the run is interrupted
 
     print("Extraction finished.")
@@ -1,5 +1,5 @@
-from tdb import TelethonHandler, Utils
-import os, time
+from tdb import TelethonHandler, Utils, Profiler
+import os, time, argparse
 from datetime import datetime
 
 # This script monitors the messages sent in a series of telegram groups to note the evolution of their metrics and values.
@@ -114,9 +114,14 @@ def save_batched(chat_id, new_messages):
 
             n_files -= 1 # Continue with next file        
     
-    Utils.save_dict(chat_id2savepath, output_chat_id2savepath)
+    Utils.save_dict(chat_id2savepath, output_chat_id2savepath, atomic=True) # Read by monitoring_compactor.py while the monitor runs
 
 if __name__ == "__main__":
+    parser= argparse.ArgumentParser(description="Monitor the evolution of the messages in telegram channels.")
+    parser.add_argument("--profile", type=int, default=None, metavar="N_CYCLES", help="Profile the first N_CYCLES monitoring cycles and write a report.")
+    parser.add_argument("--profile-output", default=None, help="Path of the profile report. Defaults to profile_report.txt in the runtime folder.")
+    args= parser.parse_args()
+
     # ********* #
     Utils.create_folder_if_not_exists(output_chats) # Create output folder if not existing
     Utils.create_folder_if_not_exists(output_runtime) # Create output folder if not existing
@@ -126,20 +131,26 @@ if __name__ == "__main__":
     TG = TelethonHandler(telegram_env_path)
     TG.connect_client(session_id=session_id)
 
+    # Time split in network, formatting, diffing and disk I/O. Disabled if --profile is not set. Started after the login.
+    profiler= Profiler(args.profile, args.profile_output or f"{output_runtime}/profile_report.txt")
+
     # First step: Get information of all channels.
     channel_info= {}
     chats_ids= []
     for channel_name in channel_names:
         channel_info[channel_name]= {}
-        chat_ids= TG.get_channel_chats(channel_name)
+        with profiler.section("network"):
+            chat_ids= TG.get_channel_chats(channel_name)
         chats_ids.extend(chat_ids)
         for chat_id in chat_ids:
             chat_id2channel_name[chat_id]= channel_name
-            channel_info[channel_name][chat_id] = TG.get_chat_info(chat_id)
+            with profiler.section("network"):
+                channel_info[channel_name][chat_id] = TG.get_chat_info(chat_id)
 
     # Dump channels info to file.
-    Utils.save_dict(channel_info, output_channel_info)
-    Utils.save_dict(chat_id2channel_name, output_chat_id2channel_name)
+    with profiler.section("disk_io"):
+        Utils.save_dict(channel_info, output_channel_info)
+        Utils.save_dict(chat_id2channel_name, output_chat_id2channel_name)
 
     if not os.path.isfile(output_tracker) or FORCE_COLD_START:
         print("Cold start. Genearting json files.")
@@ -148,7 +159,8 @@ if __name__ == "__main__":
         print("Tracker file created.")
 
         for chat_id in chats_ids:
-            last_message, last_message_id= TG.get_last_message(chat_id)
+            with profiler.section("network"):
+                last_message, last_message_id= TG.get_last_message(chat_id)
             if last_message_id is None:
                 print("No message found.")
                 continue
@@ -185,99 +197,118 @@ if __name__ == "__main__":
 
         print("All JSONs loaded.")
 
-        while True:
-            # Monitor tracked messages
-            print("Monitoring tracked messages.")
-            auxiliar_tracker_dump_flag= False # Flag to force a tracker dump if did not happen (default dump only work when new messages are detected)
-            different_messages= {} # Dict to store the different messages per chat_id. This is to dump per chat_id instead of individually.
-            for message_key, message in tracking_messages.copy().items():
-                now_time= datetime.now() # The moment when the messages are monitored
-
-                if now_time.timestamp() > datetime.fromisoformat(message.get("date")).timestamp() + TRACKER_WINDOW: 
-                    del tracking_messages[message_key] # Tracking time expired
-                    auxiliar_tracker_dump_flag= True
-                    continue
+        try:
+            while True:
+                # Monitor tracked messages
+                print("Monitoring tracked messages.")
+                auxiliar_tracker_dump_flag= False # Flag to force a tracker dump if did not happen (default dump only work when new messages are detected)
+                different_messages= {} # Dict to store the different messages per chat_id. This is to dump per chat_id instead of individually.
+                for message_key, message in tracking_messages.copy().items():
+                    now_time= datetime.now() # The moment when the messages are monitored
+
+                    if now_time.timestamp() > datetime.fromisoformat(message.get("date")).timestamp() + TRACKER_WINDOW: 
+                        del tracking_messages[message_key] # Tracking time expired
+                        auxiliar_tracker_dump_flag= True
+                        continue
                 
-                updated_message, updated_message_id= TG.get_a_message(message.get("channel_id"), message.get("id"))
-                if updated_message_id is None:
-                    del tracking_messages[message_key] # Message removed
-                    auxiliar_tracker_dump_flag= True
-                    continue
-
-                updated_message= Utils.format_message(updated_message,tracker_retrieved=now_time.isoformat())
-                updated_message_key= [*updated_message][0]
+                    with profiler.section("network"):
+                        updated_message, updated_message_id= TG.get_a_message(message.get("channel_id"), message.get("id"))
+                    if updated_message_id is None:
+                        del tracking_messages[message_key] # Message removed
+                        auxiliar_tracker_dump_flag= True
+                        continue
+
+                    with profiler.section("formatting"):
+                        updated_message= Utils.format_message(updated_message,tracker_retrieved=now_time.isoformat())
+                    updated_message_key= [*updated_message][0]
                 
-                if not is_message_different(message, updated_message[updated_message_key]): continue # If the message did not change continue 
+                    with profiler.section("diffing"):
+                        message_changed= is_message_different(message, updated_message[updated_message_key])
+                    if not message_changed: continue # If the message did not change continue 
 
-                if updated_message[updated_message_key].get("channel_id") not in different_messages: 
-                    different_messages[updated_message[updated_message_key].get("channel_id")]= {}
+                    if updated_message[updated_message_key].get("channel_id") not in different_messages: 
+                        different_messages[updated_message[updated_message_key].get("channel_id")]= {}
 
-                tracking_messages[message_key].update(updated_message[updated_message_key]) # Update tracking file values
-                Utils.save_dict(tracking_messages, output_tracker) # Update json file
-                auxiliar_tracker_dump_flag= False # Tracker dumped
+                    tracking_messages[message_key].update(updated_message[updated_message_key]) # Update tracking file values
+                    with profiler.section("disk_io"):
+                        Utils.save_dict(tracking_messages, output_tracker) # Update json file
+                    auxiliar_tracker_dump_flag= False # Tracker dumped
 
-                updated_message_key= generate_message_id(updated_message[updated_message_key].get("channel_id"), updated_message[updated_message_key].get("id"), 
-                                                         datetime.fromisoformat(updated_message[updated_message_key].get("date")).timestamp(), 
-                                                         now_time.timestamp()) # Generate a unique id for the instance of this message
+                    updated_message_key= generate_message_id(updated_message[updated_message_key].get("channel_id"), updated_message[updated_message_key].get("id"), 
+                                                             datetime.fromisoformat(updated_message[updated_message_key].get("date")).timestamp(), 
+                                                             now_time.timestamp()) # Generate a unique id for the instance of this message
 
-                updated_message[updated_message_key]= updated_message.pop([*updated_message][0]) # Update the key
+                    updated_message[updated_message_key]= updated_message.pop([*updated_message][0]) # Update the key
 
-                different_messages[updated_message[updated_message_key].get("channel_id")]= {**different_messages[updated_message[updated_message_key].get("channel_id")], **updated_message} 
+                    different_messages[updated_message[updated_message_key].get("channel_id")]= {**different_messages[updated_message[updated_message_key].get("channel_id")], **updated_message} 
 
-            # Dump updated messages to JSON file.
-            if different_messages:
-                print("Updated messages dump to file.")
-                for chat_id, messages in different_messages.items():
-                    save_batched(chat_id, messages)
+                # Dump updated messages to JSON file.
+                if different_messages:
+                    print("Updated messages dump to file.")
+                    with profiler.section("disk_io"):
+                        for chat_id, messages in different_messages.items():
+                            save_batched(chat_id, messages)
 
-            if auxiliar_tracker_dump_flag: 
-                Utils.save_dict(tracking_messages, output_tracker) # Update json file
+                if auxiliar_tracker_dump_flag: 
+                    with profiler.section("disk_io"):
+                        Utils.save_dict(tracking_messages, output_tracker) # Update json file
 
-            print("Monitoring finished.")
+                print("Monitoring finished.")
 
-            # Get new messages
-            print("Looking for new messages.")
-            auxiliar_offset_dump_flag= False # Flag to specify when to dump offset file
-            for chat_id in chat_ids:
-                messages, offset_id= TG.get_n_messages(chat_id, offset_id=chat_id2offset[chat_id])
+                # Get new messages
+                print("Looking for new messages.")
+                auxiliar_offset_dump_flag= False # Flag to specify when to dump offset file
+                for chat_id in chat_ids:
+                    with profiler.section("network"):
+                        messages, offset_id= TG.get_n_messages(chat_id, offset_id=chat_id2offset[chat_id])
 
-                if offset_id is None: continue # No new messages for this chat
-                else: auxiliar_offset_dump_flag= True # New offset
+                    if offset_id is None: continue # No new messages for this chat
+                    else: auxiliar_offset_dump_flag= True # New offset
 
-                chat_id2offset[chat_id]= offset_id # update offset
-                Utils.save_dict(chat_id2offset, output_chat_id2offset)
+                    chat_id2offset[chat_id]= offset_id # update offset
+                    with profiler.section("disk_io"):
+                        Utils.save_dict(chat_id2offset, output_chat_id2offset)
 
-                now_time= datetime.now() # The moment the messages where retrieved
+                    now_time= datetime.now() # The moment the messages where retrieved
 
-                new_messages= {}
-                for message in messages:
-                    message_date= message.date
+                    new_messages= {}
+                    for message in messages:
+                        message_date= message.date
 
-                    # If the "new" message was retrieved more than 10 hours after the message was sent dont track it (the more recent the more detail in the evolution)
-                    if now_time.timestamp() > message_date.timestamp()+(10*60*60): continue
+                        # If the "new" message was retrieved more than 10 hours after the message was sent dont track it (the more recent the more detail in the evolution)
+                        if now_time.timestamp() > message_date.timestamp()+(10*60*60): continue
 
-                    message_id= message.id
-                    message= Utils.format_message(message, tracker_retrieved=now_time.isoformat())
+                        message_id= message.id
+                        with profiler.section("formatting"):
+                            message= Utils.format_message(message, tracker_retrieved=now_time.isoformat())
 
-                    tracking_messages= {**tracking_messages, **message} # Convert to dict the messages and aggregate in a single dict
+                        tracking_messages= {**tracking_messages, **message} # Convert to dict the messages and aggregate in a single dict
 
-                    message_key= generate_message_id(chat_id, message_id, message_date.timestamp(), now_time.timestamp())
+                        message_key= generate_message_id(chat_id, message_id, message_date.timestamp(), now_time.timestamp())
 
-                    message[message_key]= message.pop([*message][0])
-                    new_messages= {**new_messages, **message}
+                        message[message_key]= message.pop([*message][0])
+                        new_messages= {**new_messages, **message}
 
-                save_batched(chat_id, new_messages)
-                print(f"New messages for chat {chat_id}: {len([*new_messages])}")
+                    with profiler.section("disk_io"):
+                        save_batched(chat_id, new_messages)
+                    print(f"New messages for chat {chat_id}: {len([*new_messages])}")
 
-                Utils.save_dict(tracking_messages, output_tracker) # Update tracking file
-            print("New messages search finished.")
+                    with profiler.section("disk_io"):
+                        Utils.save_dict(tracking_messages, output_tracker) # Update tracking file
+                print("New messages search finished.")
 
-            if auxiliar_offset_dump_flag:
-                Utils.save_dict(chat_id2offset, output_chat_id2offset)
-                print("Offset file updated.")
+                if auxiliar_offset_dump_flag:
+                    with profiler.section("disk_io"):
+                        Utils.save_dict(chat_id2offset, output_chat_id2offset)
+                    print("Offset file updated.")
+
+                profiler.step() # Cycle finished, the report is written after the requested number of cycles
+
+                with profiler.idle():
+                    time.sleep(TRACKER_TIMER) # Wait until next loop.
+        finally:
+            profiler.finish() # Write the report if the monitor is stopped before the requested number of cycles
 
-            time.sleep(TRACKER_TIMER) # Wait until next loop.
-        
         print("Monitoring finished.")
     
     print("Script finished.")
\ No newline at end of file
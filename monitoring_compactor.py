@@ -0,0 +1,228 @@
+from tdb import Utils
+from engagement_monitor import TRACKER_WINDOW, output_chats, output_runtime, output_chat_id2savepath, is_message_different
+import os, json, time
+from datetime import datetime
+
+# This script compacts the batched files written by engagement_monitor.py.
+# Only closed batch files are rewritten: files that are no longer the monitor savepath and whose messages are past the TRACKER_WINDOW.
+# Snapshots are kept at full resolution during FULL_RESOLUTION_AGE after the message was published, then downsampled to one per hour
+# until HOURLY_RESOLUTION_AGE and to one per day afterwards. Snapshots that do not change anything from the previous one are dropped.
+# Compacted files and the last kept snapshots are recorded, so each run only processes the files that were not compacted yet.
+
+FULL_RESOLUTION_AGE= 86400 # Message age (in seconds) during which every snapshot is kept.
+HOURLY_RESOLUTION_AGE= 604800 # Message age (in seconds) during which one snapshot per hour is kept. Older data keeps one per day.
+
+output_compacted= f"{output_runtime}/compacted.json" # Path for the compacted files registry.
+
+def snapshot_bucket(message) -> str:
+    """Get the time bucket a snapshot belongs to, according to the message age when it was tracked.
+
+    Args:
+        message (dict): Snapshot of a message.
+
+    Returns:
+        str: Bucket identifier. Only the last snapshot of each bucket is kept.
+    """
+    published_timestamp= datetime.fromisoformat(message.get("date")).timestamp()
+    tracked_timestamp= datetime.fromisoformat(message.get("tracker_retrieved")).timestamp()
+    age= tracked_timestamp - published_timestamp
+
+    if age < FULL_RESOLUTION_AGE: return f"full_{tracked_timestamp}" # One bucket per snapshot
+    elif age < HOURLY_RESOLUTION_AGE: return f"hour_{int(age // 3600)}"
+    else: return f"day_{int(age // 86400)}"
+
+def compact_messages(messages, path, message2state, load_batch):
+    """Downsample the snapshots of a batch and drop the ones that add nothing new. The batch is updated in place.
+
+    The first snapshot of each message is always kept. Then only the last snapshot of each bucket is kept (the most recent state),
+    replacing the previous one of the bucket even if it is in an earlier batch. When a bucket is closed, its snapshot is dropped if it
+    is equal to the previous kept one, so the last snapshot of a message is never dropped.
+
+    Args:
+        messages (dict): Batched snapshots, as written by the monitor.
+        path (str): Path of the batch.
+        message2state (dict): Carry-over state per message from the previous batches of the chat. Updated in place.
+        load_batch (callable): Returns the snapshots of a batch path, to remove replaced snapshots from earlier batches.
+    """
+    timed_keys= [key for key, message in messages.items() if message.get("tracker_retrieved") is not None] # Snapshots that can not be placed in time are kept untouched
+    timed_keys.sort(key=lambda key: datetime.fromisoformat(messages[key].get("tracker_retrieved")).timestamp())
+
+    for key in timed_keys:
+        message= messages[key]
+        message_id= f'{message.get("channel_id")}_{message.get("id")}'
+        bucket= snapshot_bucket(message)
+        pending= {"message": message, "bucket": bucket, "path": path, "key": key}
+
+        if message_id not in message2state: # The first snapshot of a message is always kept
+            message2state[message_id]= {"kept": message, "pending": None}
+            continue
+
+        state= message2state[message_id]
+        if state["pending"] is not None:
+            if state["pending"]["bucket"] == bucket:
+                load_batch(state["pending"]["path"]).pop(state["pending"]["key"], None) # Replaced by a more recent snapshot of the bucket
+            elif not is_message_different(state["kept"], state["pending"]["message"]):
+                load_batch(state["pending"]["path"]).pop(state["pending"]["key"], None) # Bucket closed with nothing new
+            else:
+                state["kept"]= state["pending"]["message"] # Bucket closed
+
+        state["pending"]= pending
+
+def prune_states(message2state, first_tracked_timestamp):
+    """Forget the messages that can not have more snapshots than the ones already compacted.
+
+    Args:
+        message2state (dict): Carry-over state per message. Updated in place.
+        first_tracked_timestamp (float): Timestamp of the first snapshot of the last compacted batch.
+    """
+    # Batches are written in order, a message whose tracking ended before this batch started will not appear again
+    for message_id, state in list(message2state.items()):
+        if datetime.fromisoformat(state["kept"].get("date")).timestamp() + TRACKER_WINDOW < first_tracked_timestamp:
+            del message2state[message_id]
+
+def flush_batches(open_batches, message2state, compacted_files, keep_pending=True):
+    """Write the compacted batches. Batches with no snapshots left are removed.
+
+    Args:
+        open_batches (dict): Path to snapshots of the batches loaded in memory. Written batches are removed from it.
+        message2state (dict): Carry-over state per message.
+        compacted_files (dict): Registry of compacted batches. Updated in place.
+        keep_pending (bool, optional): Keep in memory the batches holding a snapshot that can still be replaced. Defaults to True.
+    """
+    pending_paths= {state["pending"]["path"] for state in message2state.values() if state["pending"] is not None}
+    for path in list(open_batches):
+        if keep_pending and path in pending_paths: continue
+
+        messages= open_batches.pop(path)
+        if len(messages) == compacted_files[path]["compacted_snapshots"]: continue # Not modified
+
+        if messages:
+            Utils.save_dict(messages, path, atomic=True)
+        elif os.path.isfile(path):
+            os.remove(path)
+        compacted_files[path]["compacted_snapshots"]= len(messages)
+        print(f"Batch {path} compacted: {compacted_files[path]['snapshots']} -> {len(messages)} snapshots.")
+
+def compact_chat(paths, savepaths, compacted, now_timestamp) -> bool:
+    """Compact the closed batches of a chat that were not compacted yet, continuing the downsampling of the previous runs.
+
+    Args:
+        paths (list): Paths of the chat batches, ordered by batch number.
+        savepaths (list): Paths the monitor is writing to.
+        compacted (dict): Registry with the compacted batches ("files") and the carry-over state of each chat ("chats"). Updated in place.
+        now_timestamp (float): Current timestamp.
+
+    Returns:
+        bool: True if any batch was compacted.
+    """
+    if not paths: return False
+    chat_path= os.path.dirname(paths[0])
+    message2state= compacted["chats"].get(chat_path, {})
+    open_batches= {} # Batches loaded in memory while they hold a snapshot that can still be replaced
+
+    def load_batch(path):
+        if path not in open_batches:
+            open_batches[path]= Utils.load_dict(path) # A batch compacted in a previous run
+        return open_batches[path]
+
+    is_compacted= False
+    for path in paths:
+        if path in compacted["files"]: continue # Already compacted, never reopened unless it holds a replaceable snapshot
+        if os.path.normpath(path) in savepaths: break # The monitor is still writing to this file and the next ones
+
+        messages= Utils.load_dict(path)
+        if not is_batch_closed(path, messages, savepaths, now_timestamp): break # Next batches depend on this one
+
+        compacted["files"][path]= {
+            "compacted": datetime.fromtimestamp(now_timestamp).isoformat(),
+            "snapshots": len(messages),
+            "compacted_snapshots": len(messages)
+        }
+        open_batches[path]= messages
+        tracked_timestamps= [datetime.fromisoformat(message.get("tracker_retrieved")).timestamp() for message in messages.values() if message.get("tracker_retrieved") is not None]
+
+        compact_messages(messages, path, message2state, load_batch)
+        if tracked_timestamps: prune_states(message2state, min(tracked_timestamps))
+        flush_batches(open_batches, message2state, compacted["files"])
+        is_compacted= True
+
+    flush_batches(open_batches, message2state, compacted["files"], keep_pending=False)
+    compacted["chats"][chat_path]= message2state
+    return is_compacted
+
+def is_batch_closed(path, messages, savepaths, now_timestamp) -> bool:
+    """Check if a batched file will not be modified by the monitor anymore.
+
+    Args:
+        path (str): Path of the batched file.
+        messages (dict): Batched snapshots.
+        savepaths (list): Paths the monitor is writing to.
+        now_timestamp (float): Current timestamp.
+
+    Returns:
+        bool: True if the file is not a savepath and all its messages are past the TRACKER_WINDOW.
+    """
+    if os.path.normpath(path) in savepaths: return False # The monitor is still writing to this file
+
+    for message in messages.values():
+        if now_timestamp <= datetime.fromisoformat(message.get("date")).timestamp() + TRACKER_WINDOW: return False
+
+    return True
+
+def load_savepaths(retries=3):
+    """Load the paths the monitor is writing to.
+
+    Args:
+        retries (int, optional): Number of attempts if the file is being written. Defaults to 3.
+
+    Returns:
+        list: Normalized savepaths. None if the file could not be read.
+    """
+    if not os.path.isfile(output_chat_id2savepath): return []
+
+    for _ in range(retries):
+        try:
+            return [os.path.normpath(savepath) for savepath in Utils.load_dict(output_chat_id2savepath).values()]
+        except json.JSONDecodeError:
+            time.sleep(1) # The monitor is writing the file
+    return None
+
+def chat_batch_paths() -> list:
+    """List the batched files of the monitoring folder, grouped by chat.
+
+    Returns:
+        list: Paths of the batched files of each chat, ordered by batch number.
+    """
+    chats= []
+    for channel_name in sorted(os.listdir(output_chats)):
+        channel_path= f"{output_chats}/{channel_name}"
+        if not os.path.isdir(channel_path) or os.path.normpath(channel_path) == os.path.normpath(output_runtime): continue
+        for chat_id in sorted(os.listdir(channel_path)):
+            chat_path= f"{channel_path}/{chat_id}"
+            if not os.path.isdir(chat_path): continue
+            batch_files= [file for file in os.listdir(chat_path) if file.startswith("batch_") and file.endswith(".json")]
+            batch_files.sort(key=lambda file: int(file.split('batch_')[-1].split('.')[0]))
+            chats.append([f"{chat_path}/{file}" for file in batch_files])
+    return chats
+
+if __name__ == "__main__":
+    savepaths= None
+    if not os.path.isdir(output_chats):
+        print("No monitoring folder found.")
+    else:
+        savepaths= load_savepaths()
+        if savepaths is None: print("Savepaths file could not be read. Skipping compaction.")
+
+    if savepaths is not None:
+        Utils.create_folder_if_not_exists(output_runtime) # Create output folder if not existing
+
+        compacted= {"files": {}, "chats": {}}
+        if os.path.isfile(output_compacted):
+            compacted= Utils.load_dict(output_compacted)
+
+        now_time= datetime.now()
+        for paths in chat_batch_paths():
+            if compact_chat(paths, savepaths, compacted, now_time.timestamp()):
+                Utils.save_dict(compacted, output_compacted, atomic=True) # Record progress once per chat
+
+    print("Compaction finished.")
@@ -1,5 +1,12 @@
 import os
+import io
 import json
+import time
+import asyncio
+import pstats
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
 from telethon.sync import TelegramClient
 from telethon.tl.functions.channels import GetFullChannelRequest
 
@@ -34,8 +41,28 @@ class TelethonHandler:
 
         assert self.client.start()
 
+    async def async_connect_client(self, session_id='session0', code_callback=None):
+        """Create the session to query the telegram API from a running event loop.
 
-    def get_a_message(self, chat_id:int, message_id:int)-> tuple:
+        Args:
+            session_id (str, optional): Name of the session file. Defaults to 'session0'.
+            code_callback (callable, optional): Async function returning the code sent by telegram. Defaults to None, which asks for it in the console without blocking the event loop.
+        """
+        self.client = TelegramClient(session_id, int(self.TELEGRAM_APP_ID) , self.TELEGRAM_APP_HASH)
+        await self.client.connect()
+
+        if not await self.client.is_user_authorized():
+            await self.client.send_code_request(self.PHONE_NUMBER)
+            if code_callback is None:
+                code= await asyncio.to_thread(input, 'Enter Telegram code: ')
+            else:
+                code= await code_callback()
+            await self.client.sign_in(self.PHONE_NUMBER, code)
+
+        assert await self.client.start()
+
+
+    async def async_get_a_message(self, chat_id:int, message_id:int)-> tuple:
         """Gather a menssage in a chat.
 
         Args:
@@ -44,17 +71,25 @@ class TelethonHandler:
         Returns:
             tuple(list,int): Message , message id.
         """
-        async def async_get_a_messages(self, chat_id, message_id):
-            message = await self.client.get_messages(chat_id, ids=message_id)
+        message = await self.client.get_messages(int(chat_id), ids=int(message_id))
 
-            if not message: # If no message found return None
-                return None, None
-            else:
-                return message, message.id
+        if not message: # If no message found return None
+            return None, None
+        else:
+            return message, message.id
 
-        return self.client.loop.run_until_complete(async_get_a_messages(self, int(chat_id), int(message_id)))
+    def get_a_message(self, chat_id:int, message_id:int)-> tuple:
+        """Gather a menssage in a chat. Sync wrapper of async_get_a_message.
 
-    def get_last_message(self, chat_id:int)-> tuple:
+        Args:
+            chat_id (int): ID of the chat to get message from.
+            message_id (int): ID of the message in the chat.
+        Returns:
+            tuple(list,int): Message , message id.
+        """
+        return self.client.loop.run_until_complete(self.async_get_a_message(chat_id, message_id))
+
+    async def async_get_last_message(self, chat_id:int)-> tuple:
         """Gather last menssage in a chat.
 
         Args:
@@ -62,18 +97,76 @@ class TelethonHandler:
         Returns:
             tuple(list,int): Message , message id.
         """
-        async def async_get_last_messages(self, chat_id):
-            message = await self.client.get_messages(chat_id, offset_id=0, limit=1, reverse=False) #Reverse False gets messages from newest to oldest
-            message = message[0]
-            if not message: # If no message found return None
-                return None, None
+        message = await self.client.get_messages(int(chat_id), offset_id=0, limit=1, reverse=False) #Reverse False gets messages from newest to oldest
+        message = message[0]
+        if not message: # If no message found return None
+            return None, None
+        else:
+            return message, message.id
+
+    def get_last_message(self, chat_id:int)-> tuple:
+        """Gather last menssage in a chat. Sync wrapper of async_get_last_message.
+
+        Args:
+            chat_id (int): ID of the chat to get message from.
+        Returns:
+            tuple(list,int): Message , message id.
+        """
+        return self.client.loop.run_until_complete(self.async_get_last_message(chat_id))
+
+    async def async_iter_messages(self, chat_id:int, n_messages=None, offset_id=0, limit=100, formatted=False, **kwargs):
+        """Iterate over the menssages in a chat, from oldest to newest, one page per request.
+
+        Args:
+            chat_id (int): ID of the chat to get messages from
+            n_messages (int, optional): Maximum number of messages to retrieve. Defaults to None.
+            offset_id (int, optional): ID of the initial message (NOT INCLUDED), starting point of data gathering. Defaults to 0.
+            limit (int, optional): Maximum number of messages per request. Defaults to 100.
+            formatted (bool, optional): Yield each message formatted with Utils.format_message instead of the pages. Defaults to False.
+            **kwargs: Passed to Utils.format_message when formatted is True.
+
+        Yields:
+            list | dict: Page of Telethon messages, or formatted message if formatted is True.
+        """
+        chat_id, offset_id= int(chat_id), int(offset_id)
+        n_retrieved= 0
+        while not n_messages or n_retrieved < n_messages:
+            page_limit= min(limit, n_messages-n_retrieved) if n_messages else limit # Do not request more messages than needed
+            messages = await self.client.get_messages(chat_id, offset_id=offset_id, limit=page_limit, reverse=True) #Reverse True gets messages from oldest to newest
+            if not messages:
+                break  # If there are no more messages, exit the loop
+
+            n_retrieved += len(messages)
+            offset_id = messages[-1].id  # Update the offset_id for the next request
+
+            if formatted:
+                for message in messages:
+                    yield Utils.format_message(message, **kwargs)
             else:
-                return message, message.id
+                yield messages
+
+    async def async_get_n_messages(self, chat_id:int, n_messages=None, offset_id=0)-> tuple:
+        """Gather menssages in a chat.
+
+        Args:
+            chat_id (int): ID of the chat to get messages from
+            n_messages (int, optional): Maximum number of messages to retrieve. Defaults to None.
+            offset_id (_type_, optional): ID of the initial message (NOT INCLUDED), starting point of data gathering. Defaults to 0.
 
-        return self.client.loop.run_until_complete(async_get_last_messages(self, int(chat_id)))
+        Returns:
+            tuple(list,int): Messages list, last message id.
+        """
+        all_messages = []
+        async for messages in self.async_iter_messages(chat_id, n_messages=n_messages, offset_id=offset_id):
+            all_messages.extend(messages)
+
+        if not all_messages: # If no messages found return None
+            return None, None
+        else:
+            return all_messages, all_messages[-1].id
 
     def get_n_messages(self, chat_id:int, n_messages=None, offset_id=0)-> tuple:
-        """Gather menssages in a chat.
+        """Gather menssages in a chat. Sync wrapper of async_get_n_messages.
 
         Args:
             chat_id (int): ID of the chat to get messages from
@@ -83,37 +176,25 @@ class TelethonHandler:
         Returns:
             tuple(list,int): Messages list, last message id.
         """
-        async def async_get_n_messages(self, chat_id, n_messages, offset_id):
-            all_messages = []
-            
-            limit = 100  # Maximum number of messages per request (adjust as needed)
-            while True:
-                messages = await self.client.get_messages(chat_id, offset_id=offset_id, limit=limit, reverse=True) #Reverse True gets messages from oldest to newest
-                if not messages:
-                    break  # If there are no more messages, exit the loop
-                
-                if n_messages: # If maximum number of messages requested
-                    if len(all_messages) == n_messages:
-                        break
-                    elif len(all_messages)+len(messages) > n_messages:
-                        _n_messages= len(messages)-(len(all_messages)+len(messages)-n_messages)
-                        messages= messages[:_n_messages]
-                        offset_id = messages[-1].id
-                        all_messages.extend(messages)
-                        break
-                
-                all_messages.extend(messages)
-                offset_id = messages[-1].id  # Update the offset_id for the next request
-            
-            if not all_messages: # If no messages found return None
-                return None, None
-            else:
-                return all_messages, offset_id
+        return self.client.loop.run_until_complete(self.async_get_n_messages(chat_id, n_messages, offset_id))
+
+    async def async_get_channel_chats(self, channel_name:str)-> list:
+        """Get chat ids from channel.
+
+        Args:
+            channel_name (str): Telegram channel name.
+
+        Returns:
+            list: List of chat ids in this channel.
+        """
+        channel_entity = await self.client.get_entity(channel_name)
+        channel = await self.client(GetFullChannelRequest(channel=channel_entity))
+        chat_ids= [chat.id for chat in channel.chats]
 
-        return self.client.loop.run_until_complete(async_get_n_messages(self, int(chat_id), n_messages, int(offset_id)))
+        return chat_ids
 
     def get_channel_chats(self, channel_name:str)-> list:
-        """Get chat ids from channel.
+        """Get chat ids from channel. Sync wrapper of async_get_channel_chats.
 
         Args:
             channel_name (str): Telegram channel name.
@@ -121,53 +202,93 @@ class TelethonHandler:
         Returns:
             list: List of chat ids in this channel.
         """
-        async def async_get_channel_chats(self, channel_name):
-            channel_entity = await self.client.get_entity(channel_name)
-            channel = await self.client(GetFullChannelRequest(channel=channel_entity))
-            chat_ids= [chat.id for chat in channel.chats]
-            
-            return chat_ids
-        
-        return self.client.loop.run_until_complete(async_get_channel_chats(self, channel_name))
+        return self.client.loop.run_until_complete(self.async_get_channel_chats(channel_name))
 
-    def get_chat_info(self, chat_id:int):
+    async def async_get_chat_info(self, chat_id:int)-> dict:
         """Gets chat info in dictionary format.
 
         Args:
             chat_id (int): Chat id to retrieve information
         """
-        async def async_get_chat_info(self, chat_id):
-            chat= await self.client.get_entity(chat_id)
-            chat_info= {
-                "id": chat.id,
-                "created": chat.date.isoformat(),
-                "title": chat.title,
-                "username": chat.username
-            }
+        chat_id= int(chat_id)
+        chat= await self.client.get_entity(chat_id)
+        chat_info= {
+            "id": chat.id,
+            "created": chat.date.isoformat(),
+            "title": chat.title,
+            "username": chat.username
+        }
+
+        channel= await self.client(GetFullChannelRequest(channel=chat_id))
+        if chat_id in [_chat.id for _chat in channel.chats]:
+            chat_info["about"]= channel.full_chat.about
+            chat_info["participants_count"]= channel.full_chat.participants_count
+
+        return chat_info
+
+    def get_chat_info(self, chat_id:int)-> dict:
+        """Gets chat info in dictionary format. Sync wrapper of async_get_chat_info.
+
+        Args:
+            chat_id (int): Chat id to retrieve information
+        """
+        return self.client.loop.run_until_complete(self.async_get_chat_info(chat_id))
+
+    async def async_get_chats_info(self, chat_ids:list, max_concurrency=10)-> dict:
+        """Gets the info of several chats concurrently.
+
+        Args:
+            chat_ids (list): Chat ids to retrieve information.
+            max_concurrency (int, optional): Maximum number of chats requested at the same time. Defaults to 10.
+
+        Returns:
+            dict: Chat id to chat info, in the chat_ids order. A failing chat id is mapped to its exception instead of cancelling the whole call.
+        """
+        semaphore= asyncio.Semaphore(max_concurrency)
+
+        async def async_get_limited_chat_info(chat_id):
+            async with semaphore:
+                return await self.async_get_chat_info(chat_id)
 
-            channel= await self.client(GetFullChannelRequest(channel=chat_id))
-            if chat_id in [_chat.id for _chat in channel.chats]:
-                chat_info["about"]= channel.full_chat.about
-                chat_info["participants_count"]= channel.full_chat.participants_count
+        chats_info= await asyncio.gather(*[async_get_limited_chat_info(chat_id) for chat_id in chat_ids], return_exceptions=True)
+        return dict(zip(chat_ids, chats_info))
+
+    def get_chats_info(self, chat_ids:list, max_concurrency=10)-> dict:
+        """Gets the info of several chats concurrently. Sync wrapper of async_get_chats_info.
+
+        Args:
+            chat_ids (list): Chat ids to retrieve information.
+            max_concurrency (int, optional): Maximum number of chats requested at the same time. Defaults to 10.
 
-            return chat_info
-        return self.client.loop.run_until_complete(async_get_chat_info(self, int(chat_id)))
+        Returns:
+            dict: Chat id to chat info, in the chat_ids order. A failing chat id is mapped to its exception instead of cancelling the whole call.
+        """
+        return self.client.loop.run_until_complete(self.async_get_chats_info(chat_ids, max_concurrency))
 
 
 class Utils:
     @staticmethod
-    def save_dict(_dict:dict, path:str) -> bool:
+    def save_dict(_dict:dict, path:str, atomic:bool=False) -> bool:
         """Dumps dict to a json file..
 
         Args:
             _dict (dict): Dict to be dumped.
             path (str): Path to dump.
+            atomic (bool, optional): Write to a temporary file and replace the original, so readers never see a partial file. Defaults to False.
 
         Returns:
             bool: True if the file is dumped.
         """
-        with open(path, "w") as f:
-            f.write(json.dumps(_dict))
+        if atomic:
+            tmp_path= f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(json.dumps(_dict))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path) # Atomic on the same filesystem
+        else:
+            with open(path, "w") as f:
+                f.write(json.dumps(_dict))
         print(f"File dumped to {path}")
         return True
     
@@ -364,3 +485,131 @@ class Utils:
         if kwargs: msg.update(kwargs) # If any element in kwargs update the msg with its values
         
         return {msg_key: msg}
+
+
+class Profiler:
+    def __init__(self, n_steps=None, report_path="profile_report.txt", top=20) -> None:
+        """Creates the Profiler class. Profiles the first n_steps (batches or cycles) with cProfile and tracemalloc.
+
+        Args:
+            n_steps (int, optional): Number of steps to profile. Profiling is disabled if None or 0. Defaults to None.
+            report_path (str, optional): Path of the report file. Defaults to "profile_report.txt".
+            top (int, optional): Number of hotspots and allocations in the report. Defaults to 20.
+        """
+        self.enabled= bool(n_steps)
+        self.n_steps= n_steps
+        self.report_path= report_path
+        self.top= top
+
+        self.n_step= 0
+        self.section_times= {} # Category: seconds spent in it
+        self.step_peaks= [] # Peak of traced memory per step (bytes)
+        self.idle_time= 0 # Seconds excluded from profiling
+        self.peak_snapshot= None # Allocations at the end of the step with the highest peak
+        self.peak_snapshot_moment= None
+
+        if self.enabled:
+            tracemalloc.start()
+            self.profile= cProfile.Profile()
+            self.start_time= time.perf_counter()
+            self.profile.enable()
+
+    @contextmanager
+    def section(self, category:str):
+        """Accumulate the time spent in a block of code. E.g. "network", "formatting", "diffing", "disk_io".
+
+        Args:
+            category (str): Category of the block.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        start_time= time.perf_counter()
+        try:
+            yield
+        finally:
+            self.section_times[category]= self.section_times.get(category, 0) + time.perf_counter() - start_time
+
+    @contextmanager
+    def idle(self):
+        """Exclude a block of code from profiling and from the wall time. E.g. the wait between monitoring cycles.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        self.profile.disable()
+        start_time= time.perf_counter()
+        try:
+            yield
+        finally:
+            self.idle_time += time.perf_counter() - start_time
+            self.profile.enable()
+
+    def record_peak(self, moment:str):
+        """Record the traced memory peak since the last call and keep the allocations of the highest one.
+
+        Args:
+            moment (str): Description of the moment for the report. E.g. "at the end of step 1".
+        """
+        peak= tracemalloc.get_traced_memory()[1]
+        if not self.step_peaks or peak > max(self.step_peaks):
+            self.peak_snapshot= tracemalloc.take_snapshot()
+            self.peak_snapshot_moment= moment
+        self.step_peaks.append(peak)
+        tracemalloc.reset_peak() # Peak of the next step
+
+    def step(self) -> bool:
+        """Mark the end of a batch or cycle. The report is written when the number of steps is reached.
+
+        Returns:
+            bool: True if the report is written.
+        """
+        if not self.enabled: return False
+
+        self.n_step += 1
+        self.record_peak(f"at the end of step {self.n_step}")
+
+        if self.n_step >= self.n_steps:
+            return self.finish()
+        return False
+
+    def finish(self) -> bool:
+        """Stop profiling and write the report.
+
+        Returns:
+            bool: True if the report is written. False if profiling was not enabled.
+        """
+        if not self.enabled: return False
+        self.enabled= False
+
+        self.profile.disable()
+        wall_time= time.perf_counter() - self.start_time - self.idle_time
+        if self.n_step < self.n_steps:
+            self.record_peak("when the run was stopped") # Steps not finished, e.g. interrupted run
+        peak= max(self.step_peaks)
+        tracemalloc.stop()
+
+        report= [f"Profiled steps: {self.n_step}", f"Wall time: {wall_time:.2f} s (idle time excluded: {self.idle_time:.2f} s)", "", "Time split:"]
+        for category, seconds in sorted(self.section_times.items(), key=lambda item: item[1], reverse=True):
+            report.append(f"\t{category}: {seconds:.2f} s ({100*seconds/wall_time:.1f}%)")
+        other_time= wall_time - sum(self.section_times.values())
+        report.append(f"\tother: {other_time:.2f} s ({100*other_time/wall_time:.1f}%)")
+
+        report.extend(["", f"Peak memory: {peak/2**20:.2f} MiB"])
+        report.append("Peak memory per step (MiB): " + ", ".join([f"{step_peak/2**20:.2f}" for step_peak in self.step_peaks]))
+
+        for sort_key in ["tottime", "cumulative"]:
+            stream= io.StringIO()
+            pstats.Stats(self.profile, stream=stream).sort_stats(sort_key).print_stats(self.top)
+            report.extend(["", f"Top hotspots by {sort_key}:", stream.getvalue().strip("\n")])
+
+        report.append(f"Top allocations alive {self.peak_snapshot_moment} (highest memory peak):")
+        for statistic in self.peak_snapshot.statistics("lineno")[:self.top]:
+            report.append(f"\t{statistic}")
+
+        with open(self.report_path, "w") as f:
+            f.write("\n".join(report) + "\n")
+        print(f"Profile report dumped to {self.report_path}")
+        return True
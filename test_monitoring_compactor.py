@@ -0,0 +1,69 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("telethon") # monitoring_compactor imports the monitor settings, which need the telegram dependencies
+pytest.importorskip("dotenv")
+
+import monitoring_compactor
+
+published= datetime(2024, 1, 1, tzinfo=timezone.utc)
+now_timestamp= (published + timedelta(days=60)).timestamp() # All messages are past the tracking window
+
+def snapshot(message_id, tracked, views):
+    return {"channel_id": 1, "id": message_id, "date": published.isoformat(), "tracker_retrieved": tracked.isoformat(), "views": views}
+
+def write_batches(chat_path, snapshots, batch_size):
+    chat_path.mkdir(parents=True, exist_ok=True)
+    paths= []
+    for n_batch, start in enumerate(range(0, len(snapshots), batch_size), start=1):
+        path= f"{chat_path}/batch_{n_batch}.json"
+        with open(path, "w") as f:
+            json.dump(dict(snapshots[start:start+batch_size]), f)
+        paths.append(path)
+    return paths
+
+def load_batches(paths):
+    messages= {}
+    for path in paths:
+        try:
+            with open(path) as f:
+                messages.update(json.load(f))
+        except FileNotFoundError:
+            pass # Batches with no snapshots left are removed
+    return messages
+
+def test_bucket_spanning_two_batches_keeps_first_and_last(tmp_path):
+    # 12 snapshots in the same hour (hourly resolution), split in two batches
+    tracked= published + timedelta(days=2)
+    snapshots= [(f"1_1_{n}", snapshot(1, tracked + timedelta(minutes=5*n), round(15*n/11))) for n in range(12)]
+    paths= write_batches(tmp_path / "foo" / "1", snapshots, batch_size=6)
+
+    compacted= {"files": {}, "chats": {}}
+    assert monitoring_compactor.compact_chat(paths, [], compacted, now_timestamp)
+
+    views= [message["views"] for message in load_batches(paths).values()]
+    assert views == [0, 15] # First snapshot of the message and most recent state
+
+def test_incremental_runs_match_single_run(tmp_path):
+    snapshots= []
+    for n in range(12 * 24 * 10): # One snapshot every 5 minutes during 10 days
+        for message_id in range(3):
+            snapshots.append((f"1_{message_id}_{n}", snapshot(message_id, published + timedelta(minutes=5*n), n // 2)))
+
+    single_paths= write_batches(tmp_path / "single" / "1", snapshots, batch_size=500)
+    monitoring_compactor.compact_chat(single_paths, [], {"files": {}, "chats": {}}, now_timestamp)
+
+    # First run while the monitor is still writing to the middle batch, then the rest
+    paths= write_batches(tmp_path / "incremental" / "1", snapshots, batch_size=500)
+    compacted= {"files": {}, "chats": {}}
+    assert monitoring_compactor.compact_chat(paths, [paths[len(paths)//2]], compacted, now_timestamp)
+    compacted= json.loads(json.dumps(compacted)) # The registry is persisted between runs
+    assert monitoring_compactor.compact_chat(paths, [], compacted, now_timestamp)
+
+    assert list(load_batches(paths).values()) == list(load_batches(single_paths).values())
+    assert max(message["views"] for message in load_batches(paths).values()) == (12 * 24 * 10 - 1) // 2
+
+    # Re-run on batches already compacted
+    assert not monitoring_compactor.compact_chat(paths, [], compacted, now_timestamp)